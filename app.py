@@ -1,150 +1,358 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, jsonify, make_response
 from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
+from markupsafe import Markup
+from jinja2 import FileSystemBytecodeCache
+from functools import wraps, lru_cache
 import os
 import sqlite3
-import random
-from datetime import datetime
-import json # New Import
+import orjson
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import click
+from types import MappingProxyType
 
 # --- NEW IMPORTS for Gemini AI and .env ---
 from dotenv import load_dotenv
 from google import genai 
 from google.genai import types # New Import
+from pydantic import BaseModel, Field
 
 # Load environment variables from .env file immediately
 load_dotenv()
 # --- END NEW IMPORTS ---
 
+# One shared Gemini client so its HTTP connection pool is reused across requests.
+# The client automatically picks up the GEMINI_API_KEY from the environment.
+try:
+    GEMINI_CLIENT = genai.Client()
+except Exception as e:
+    print(f"Error initializing Gemini client: {e}")
+    GEMINI_CLIENT = None
+
 
 app = Flask(__name__)
 # IMPORTANT: Change this in production
 app.secret_key = 'your-secret-key-here-change-in-production' 
 
+# Password hashing scheme, pinned so it can't drift with Werkzeug's default.
+# scrypt N=32768, r=8, p=1 costs ~100 ms per hash; tune it for the production CPU with
+# `flask time-password-hash` and override it via the environment (e.g. 'pbkdf2:sha256:600000').
+# check_password_hash reads the method from each stored hash, so older hashes keep
+# verifying and are upgraded to this method on the user's next login.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+@lru_cache(maxsize=None)
+def dummy_password_hash():
+    """
+    Hash verified against when a login names an unknown user, so that case costs the same
+    as a real one and response time doesn't reveal which usernames exist. Created on first
+    use rather than at import, so workers and CLI commands don't pay for it up front.
+    """
+    return generate_password_hash(os.urandom(16).hex(), method=PASSWORD_HASH_METHOD)
+
+def password_hash_prefix():
+    """
+    PASSWORD_HASH_METHOD as Werkzeug writes it into stored hashes ('<method>$<salt>$<hash>').
+    Short spellings are expanded, e.g. 'scrypt' is stored as 'scrypt:32768:8:1'.
+    """
+    return dummy_password_hash().split('$', 1)[0]
+
 # Use the Flask instance folder for the DB
 db_path = os.path.join(app.instance_path, 'museum_app.db')
 os.makedirs(app.instance_path, exist_ok=True)
 
+# Compiled templates are kept in the instance folder too, so a freshly started worker loads
+# them instead of re-parsing every template. Entries are checked against the template
+# source, so an edited template is recompiled. Template auto-reload (a stat per render)
+# follows debug mode, which stays off unless FLASK_DEBUG is set.
+jinja_cache_dir = os.path.join(app.instance_path, 'jinja_cache')
+os.makedirs(jinja_cache_dir, exist_ok=True)
+app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(jinja_cache_dir))
+
 
 # --- GEMINI API HELPERS ---
 
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Replay mode: serve AI content from the SQLite cache only, never call Gemini (offline/dev)
+AI_CACHE_REPLAY = os.environ.get('AI_CACHE_REPLAY', '').lower() in ('1', 'true', 'yes')
+
+# How long a generated quiz is served from quiz_variants before it is regenerated (default: 7 days)
+QUIZ_CACHE_TTL = int(os.environ.get('QUIZ_CACHE_TTL', 7 * 24 * 60 * 60))
+
+# Fresh quizzes kept per museum. Each GET serves one at random, and the pool is topped up
+# in the background until it is full, so repeat visitors don't always get the same quiz.
+QUIZ_POOL_SIZE = int(os.environ.get('QUIZ_POOL_SIZE', 3))
+
 # Define the structured output for the quiz
-QUIZ_SCHEMA = {
-    "type": "object",
-    "properties": {
-        "quiz_title": {"type": "string", "description": "A catchy title for the quiz."},
-        "questions": {
-            "type": "array",
-            "description": "A list of 5 multiple-choice questions about the museum.",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "question": {"type": "string", "description": "The quiz question."},
-                    "options": {
-                        "type": "array",
-                        "description": "Exactly four answer options.",
-                        "items": {"type": "string"}
-                    },
-                    "answer": {"type": "string", "description": "The correct answer option (must match one of the options in the list exactly)."}
-                },
-                "required": ["question", "options", "answer"]
-            }
-        }
-    },
-    "required": ["quiz_title", "questions"]
-}
+class QuizQuestion(BaseModel):
+    question: str = Field(description="The quiz question.")
+    options: list[str] = Field(description="Exactly four answer options.")
+    answer: str = Field(description="The correct answer option (must match one of the options in the list exactly).")
+
+
+class Quiz(BaseModel):
+    quiz_title: str = Field(description="A catchy title for the quiz.")
+    questions: list[QuizQuestion] = Field(description="A list of 5 multiple-choice questions about the museum.")
+
 
-def get_museum_summary(museum_name, city):
+# Given a Pydantic class, the SDK rebuilds its own Schema object from it on every call.
+# Converting once here and sharing the config leaves only a cheap copy per request.
+QUIZ_RESPONSE_SCHEMA = types.Schema.from_json_schema(
+    json_schema=types.JSONSchema.model_validate(Quiz.model_json_schema()),
+    api_option='GEMINI_API'
+)
+
+QUIZ_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=QUIZ_RESPONSE_SCHEMA
+)
+
+def summary_cache_key(museum_name, city):
     """
-    Calls the Gemini API to get a summary of a museum. (Existing function)
+    Hash identifying the inputs a cached summary was generated from.
+    A changed name, city or model produces a new hash and invalidates the cached row.
     """
-    try:
-        # The client automatically picks up the GEMINI_API_KEY from the environment
-        client = genai.Client() 
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        return "AI summary service unavailable. Check your GEMINI_API_KEY."
+    return hashlib.sha256(f"{museum_name}|{city}|{GEMINI_MODEL}".encode('utf-8')).hexdigest()
 
-    prompt = (
+
+def summary_prompt(museum_name, city):
+    return (
         f"Provide a concise, engaging, and factual summary of the {museum_name} in {city}. "
         f"The summary should be about 3-4 sentences long and focus on its historical significance or main collections."
     )
 
+
+def quiz_prompt(museum_name, museum_city):
+    return (
+        f"Generate a fun 5-question multiple-choice quiz about the {museum_name} in {museum_city}. "
+        f"Each question must have exactly 4 options. The correct answer must be one of the options."
+    )
+
+
+def quiz_to_dict(quiz):
+    """
+    Converts a parsed Quiz into the dict stored in the cache and session,
+    raising ValueError if it is not usable.
+    """
+    if quiz is None:
+        raise ValueError("Gemini returned no parseable quiz.")
+    # Add a fallback for ensuring 5 questions, although the model usually adheres to the schema
+    if len(quiz.questions) != 5:
+         raise ValueError("Generated quiz did not contain exactly 5 questions.")
+    return quiz.model_dump()
+
+
+def parse_quiz(response_text):
+    """
+    Validates raw quiz JSON (e.g. from a batch job) into the quiz dict.
+    """
+    return quiz_to_dict(Quiz.model_validate_json(response_text))
+
+
+# In-process memo in front of the ai_summaries table: (museum_key, prompt_hash) -> summary.
+# Bounded by the size of MUSEUM_DATA and only ever holds successful responses.
+_SUMMARY_MEMO = {}
+
+def cached_museum_summary(museum_key, museum_name, city):
+    """
+    Returns the museum's summary from memory or the ai_summaries cache, or None.
+    Never calls the Gemini API.
+    """
+    prompt_hash = summary_cache_key(museum_name, city)
+    memo_key = (museum_key, prompt_hash)
+    cached_summary = _SUMMARY_MEMO.get(memo_key)
+    if cached_summary is not None:
+        return cached_summary
+
+    cached_summary = get_cached_summary(museum_key, prompt_hash)
+    if cached_summary is not None:
+        _SUMMARY_MEMO[memo_key] = cached_summary
+    return cached_summary
+
+
+def get_museum_summary(museum_key, museum_name, city):
+    """
+    Returns a summary of a museum. Served from memory or the ai_summaries cache when possible,
+    otherwise calls the Gemini API and stores the result for subsequent requests.
+    """
+    cached_summary = cached_museum_summary(museum_key, museum_name, city)
+    if cached_summary is not None:
+        return cached_summary
+
+    if AI_CACHE_REPLAY:
+        return "AI summary not cached yet (replay mode)."
+
+    client = GEMINI_CLIENT
+    if client is None:
+        return "AI summary service unavailable. Check your GEMINI_API_KEY."
+
     try:
         response = client.models.generate_content(
-            model="gemini-2.5-flash", 
-            contents=prompt
+            model=GEMINI_MODEL, 
+            contents=summary_prompt(museum_name, city)
         )
-        return response.text
     except Exception as e:
         print(f"Error calling Gemini API for {museum_name}: {e}")
         return f"Could not fetch AI summary for {museum_name}."
 
+    if not response.text:
+        return f"Could not fetch AI summary for {museum_name}."
+
+    # Only successful responses are cached, errors are retried on the next request
+    prompt_hash = summary_cache_key(museum_name, city)
+    with get_db():
+        save_summary(museum_key, prompt_hash, response.text)
+    _SUMMARY_MEMO[(museum_key, prompt_hash)] = response.text
+    return response.text
+
 
-def generate_quiz(museum_name, museum_city):
+def generate_quiz(museum_key, museum_name, museum_city):
     """
-    Calls the Gemini API to generate a multiple-choice quiz about a museum 
-    and returns the data as a Python dictionary.
+    Returns a multiple-choice quiz about a museum as a Python dictionary.
+    A quiz stored in quiz_variants carries its row 'id'; the fallback quiz has none.
+    Served from the museum's pool in quiz_variants while it has a quiz younger than
+    QUIZ_CACHE_TTL, otherwise calls the Gemini API and caches the result.
     """
-    try:
-        client = genai.Client()
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        return None
+    cached_quiz, _ = get_cached_quiz(museum_key, QUIZ_CACHE_TTL)
+    if cached_quiz is not None:
+        return cached_quiz
 
-    prompt = (
-        f"Generate a fun 5-question multiple-choice quiz about the {museum_name} in {museum_city}. "
-        f"Each question must have exactly 4 options. The correct answer must be one of the options."
-    )
+    if AI_CACHE_REPLAY:
+        return fallback_quiz(museum_name, museum_city)
+
+    return new_quiz_variant(museum_key, museum_name, museum_city)
+
+
+def new_quiz_variant(museum_key, museum_name, museum_city):
+    """
+    Asks Gemini for a new quiz and adds it to the museum's pool, ignoring what is cached.
+    """
+    client = GEMINI_CLIENT
+    if client is None:
+        return None
 
     try:
         response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=QUIZ_SCHEMA
-            )
+            model=GEMINI_MODEL,
+            contents=quiz_prompt(museum_name, museum_city),
+            config=QUIZ_CONFIG
         )
-        # The response text is a JSON string, which we load into a dict
-        quiz_data = json.loads(response.text)
-        # Add a fallback for ensuring 5 questions, although the model usually adheres to the schema
-        if len(quiz_data.get('questions', [])) != 5:
-             raise ValueError("Generated quiz did not contain exactly 5 questions.")
-        return quiz_data
+        # With a Schema response_schema the SDK hands back the already-decoded JSON
+        quiz_data = quiz_to_dict(Quiz.model_validate(response.parsed))
     except Exception as e:
         print(f"Error calling Gemini API for quiz: {e}")
-        # Return a simple fallback quiz on error
-        return {
-            "quiz_title": f"Fallback Quiz on {museum_name}",
-            "questions": [
-                {
-                    "question": f"Which city is the {museum_name} located in?",
-                    "options": [museum_city, "Mumbai", "Kolkata", "Delhi"],
-                    "answer": museum_city
-                },
-                {
-                    "question": "What is the primary purpose of a museum?",
-                    "options": ["Entertainment", "Education and Preservation", "Shopping", "Sports"],
-                    "answer": "Education and Preservation"
-                },
-                {
-                    "question": "In which continent is India located?",
-                    "options": ["Europe", "Africa", "Asia", "South America"],
-                    "answer": "Asia"
-                },
-                {
-                    "question": "The famous 'Dancing Girl' statuette belongs to which civilization?",
-                    "options": ["Egyptian", "Mesopotamian", "Indus Valley", "Roman"],
-                    "answer": "Indus Valley"
-                },
-                {
-                    "question": "The term 'Mughal' refers to a dynasty from which country?",
-                    "options": ["China", "India", "Turkey", "Mongolia"],
-                    "answer": "Mongolia"
-                }
-            ]
-        }
+        # Return a simple fallback quiz on error (never cached)
+        return fallback_quiz(museum_name, museum_city)
+
+    with get_db():
+        quiz_data['id'] = save_quiz(museum_key, quiz_data)
+    return quiz_data
+
+
+def fallback_quiz(museum_name, museum_city):
+    """
+    A static quiz used when Gemini is unavailable or returns an invalid quiz.
+    """
+    return {
+        "quiz_title": f"Fallback Quiz on {museum_name}",
+        "questions": [
+            {
+                "question": f"Which city is the {museum_name} located in?",
+                "options": [museum_city, "Mumbai", "Kolkata", "Delhi"],
+                "answer": museum_city
+            },
+            {
+                "question": "What is the primary purpose of a museum?",
+                "options": ["Entertainment", "Education and Preservation", "Shopping", "Sports"],
+                "answer": "Education and Preservation"
+            },
+            {
+                "question": "In which continent is India located?",
+                "options": ["Europe", "Africa", "Asia", "South America"],
+                "answer": "Asia"
+            },
+            {
+                "question": "The famous 'Dancing Girl' statuette belongs to which civilization?",
+                "options": ["Egyptian", "Mesopotamian", "Indus Valley", "Roman"],
+                "answer": "Indus Valley"
+            },
+            {
+                "question": "The term 'Mughal' refers to a dynasty from which country?",
+                "options": ["China", "India", "Turkey", "Mongolia"],
+                "answer": "Mongolia"
+            }
+        ]
+    }
+
+
+# --- BACKGROUND QUIZ GENERATION ---
+# Quiz generation takes seconds, so on a cache miss it runs on this pool instead of
+# holding the request thread. Under gevent/eventlet workers, make sure threads are
+# not monkey-patched into greenlets or the calls will block the worker again.
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# How long a claimed generation may run before other workers treat it as abandoned
+# (e.g. its worker was restarted) and may claim it again (seconds)
+QUIZ_JOB_TIMEOUT = 120
+
+# The quiz_jobs table records which generations are running, so every worker process
+# agrees on it. This museum_key -> Future map only lets the worker running a job answer
+# for it without a DB round-trip.
+_QUIZ_JOBS = {}
+_QUIZ_JOBS_LOCK = threading.Lock()
+
+def _populate_quiz_cache(museum_key, museum_name, museum_city):
+    # Executor threads have no app context of their own, which get_db() needs
+    with app.app_context():
+        quiz_data = None
+        try:
+            # Another worker process may have filled the pool while this job was queued
+            cached_quiz, pool_size = get_cached_quiz(museum_key, QUIZ_CACHE_TTL)
+            if pool_size >= QUIZ_POOL_SIZE:
+                quiz_data = cached_quiz
+            else:
+                quiz_data = new_quiz_variant(museum_key, museum_name, museum_city)
+        except Exception as e:
+            print(f"Background quiz generation failed for {museum_key}: {e}")
+        finally:
+            # A quiz without an id (the fallback, or None) was not stored. The failure is
+            # recorded so the next quiz GET, on any worker, serves the fallback quiz.
+            with get_db():
+                if quiz_data and quiz_data.get('id') is not None:
+                    finish_quiz_job(museum_key, 'running')
+                else:
+                    fail_quiz_job(museum_key)
+        return quiz_data
+
+def start_quiz_generation(museum_key, museum_name, museum_city):
+    """
+    Adds a quiz to the museum's pool in the background, unless some worker is already
+    generating one for it.
+    """
+    with _QUIZ_JOBS_LOCK:
+        future = _QUIZ_JOBS.get(museum_key)
+        if future is not None and not future.done():
+            return
+    with get_db():
+        claimed = claim_quiz_job(museum_key)
+    if claimed:
+        with _QUIZ_JOBS_LOCK:
+            _QUIZ_JOBS[museum_key] = EXECUTOR.submit(_populate_quiz_cache, museum_key, museum_name, museum_city)
+
+def quiz_generation_state(museum_key):
+    """
+    'running' or 'failed' for the museum's latest generation on any worker, or None if
+    there is none (finished, abandoned or never started).
+    """
+    with _QUIZ_JOBS_LOCK:
+        future = _QUIZ_JOBS.get(museum_key)
+    if future is not None and not future.done():
+        return 'running'
+    return get_quiz_job_state(museum_key)
+# --- END BACKGROUND QUIZ GENERATION ---
 # --- END GEMINI API HELPERS ---
 
 
@@ -394,17 +602,110 @@ MUSEUM_DATA = {
 }
 # --- END CORE DATA MODEL ---
 
+# MUSEUM_DATA is static, so the listings derived from it are built once at import.
+# Each entry is a copy of the museum dict with its URL slug added under 'key', wrapped
+# read-only because the same objects are shared by every request, template and cache.
+MUSEUM_LIST = tuple(MappingProxyType(dict(data, key=key)) for key, data in MUSEUM_DATA.items())
+MUSEUMS_BY_NAME = tuple(sorted(MUSEUM_LIST, key=lambda m: m['name'].lower()))
+# museum_key -> image URLs of its top exhibits, for the profile page gallery
+_GALLERY_IMAGES = {
+    key: tuple(exhibit['img'] for exhibit in data.get('top_exhibits', []))
+    for key, data in MUSEUM_DATA.items()
+}
+# (museum, lowercased name, lowercased city) in name order, so a search lowercases only the query
+_MUSEUM_SEARCH_FIELDS = tuple((m, m['name'].lower(), m['city'].lower()) for m in MUSEUMS_BY_NAME)
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# Trigram -> positions in _MUSEUM_SEARCH_FIELDS whose name or city contains it. Any
+# substring of 3+ characters contains all of its own trigrams, so intersecting their
+# sets narrows a search to a few candidates before the exact `in` check.
+_SEARCH_TRIGRAMS = {}
+for _pos, (_, _name, _city) in enumerate(_MUSEUM_SEARCH_FIELDS):
+    for _trigram in _trigrams(_name) | _trigrams(_city):
+        _SEARCH_TRIGRAMS.setdefault(_trigram, set()).add(_pos)
+del _pos, _name, _city, _trigram
+
+# Results depend only on the query and the static directory, so popular searches are memoized.
+# The page itself is still rendered per request: it carries per-user badges and flashes.
+@lru_cache(maxsize=256)
+def search_museums(search_query):
+    """Museums whose name or city contains the lowercased query, as a tuple in name order."""
+    if len(search_query) >= 3:
+        candidates = None
+        for trigram in _trigrams(search_query):
+            positions = _SEARCH_TRIGRAMS.get(trigram)
+            if not positions:
+                return ()
+            candidates = positions if candidates is None else candidates & positions
+        fields = [_MUSEUM_SEARCH_FIELDS[pos] for pos in sorted(candidates)]
+    else:
+        # Too short for a trigram, scan everything
+        fields = _MUSEUM_SEARCH_FIELDS
+    return tuple(m for m, name, city in fields if search_query in name or search_query in city)
+
+# Rendered card grid for the full, unfiltered directory, keyed by is_quiz_selection.
+# Only the quiz selection page uses it; the dashboard grid carries per-user badges.
+# Filled on first use rather than at import because url_for needs a request context.
+_MUSEUM_GRID_HTML = {}
+
+def museum_grid_html(is_quiz_selection):
+    html = _MUSEUM_GRID_HTML.get(is_quiz_selection)
+    if html is None:
+        html = Markup(render_template(
+            '_museum_grid.html',
+            museums=MUSEUMS_BY_NAME,
+            is_quiz_selection=is_quiz_selection
+        ))
+        _MUSEUM_GRID_HTML[is_quiz_selection] = html
+    return html
+
 
 def get_db():
-    conn = sqlite3.connect(db_path)
-    # Set row factory to sqlite3.Row for dictionary-like access
-    conn.row_factory = sqlite3.Row
+    """
+    Returns the SQLite connection for the current app context, opening it on first use.
+    Helpers borrow this connection; it is closed in close_db() at teardown.
+    """
+    conn = getattr(g, 'db', None)
+    if conn is None:
+        conn = sqlite3.connect(db_path)
+        # Set row factory to sqlite3.Row for dictionary-like access
+        conn.row_factory = sqlite3.Row
+        # Per-connection settings; WAL itself is persistent and set once by init_db().
+        # NORMAL sync is safe under WAL and skips an fsync per commit.
+        conn.executescript('''
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-20000;
+        ''')
+        g.db = conn
     return conn
 
+@app.teardown_appcontext
+def close_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
 # --- Database Initialization (Unmodified) ---
+# Version of the schema created by init_db(). Bump it and add an `if version < N:` step
+# to init_db() whenever the schema changes, so existing databases are upgraded in place.
+SCHEMA_VERSION = 3
+
 def init_db():
     conn = get_db()
-    try:
+    # WAL lets readers and the writer proceed concurrently. The mode is stored in the
+    # database file, so it only needs setting here, not on every connection.
+    conn.execute('PRAGMA journal_mode=WAL')
+
+    # PRAGMA user_version records the schema a database file was last brought up to,
+    # so a warm start against a provisioned database skips all DDL.
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    if version < 1:
         conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -425,6 +726,9 @@ def init_db():
                 FOREIGN KEY (user_id) REFERENCES users (id)
             );
         ''')
+        # Serves the profile page reviews (WHERE museum_key = ? ORDER BY timestamp DESC) as an index range scan
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_reviews_museum_ts ON reviews (museum_key, timestamp DESC);')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_reviews_user ON reviews (user_id);')
         conn.execute('''
             CREATE TABLE IF NOT EXISTS wishlist_status (
                 user_id INTEGER NOT NULL,
@@ -434,94 +738,254 @@ def init_db():
                 FOREIGN KEY (user_id) REFERENCES users (id)
             );
         ''')
-        conn.commit()
-    finally:
-        conn.close()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ai_summaries (
+                museum_key TEXT PRIMARY KEY,
+                prompt_hash TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS quiz_cache (
+                museum_key TEXT PRIMARY KEY,
+                quiz_json TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
 
-# Initialize the database when the app starts
-with app.app_context():
-    init_db()
+    if version < 2:
+        # quiz_cache held one quiz per museum; quiz_variants holds a pool of them
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS quiz_variants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                museum_key TEXT NOT NULL,
+                quiz_json TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_quiz_variants_museum_ts ON quiz_variants (museum_key, created_at);')
+        conn.execute('''
+            INSERT INTO quiz_variants (museum_key, quiz_json, created_at)
+            SELECT museum_key, quiz_json, created_at FROM quiz_cache
+        ''')
+        conn.execute('DROP TABLE quiz_cache;')
+
+    if version < 3:
+        # Quiz generations in flight (or just failed), shared by all worker processes
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS quiz_jobs (
+                museum_key TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+
+# The schema is created by `flask init-db` (run once per deploy, before starting the
+# workers) rather than at import, so each gunicorn worker doesn't repeat it.
+
+# --- SQL Statements ---
+# Defined once at module level instead of as literals inside each helper. sqlite3 keeps
+# a per-connection cache of compiled statements keyed by this text, so repeated calls
+# on the shared connection skip re-parsing and re-planning.
+_SQL_GET_USER = 'SELECT id, username, password_hash FROM users WHERE username = ?'
+_SQL_GET_USER_ID = 'SELECT id FROM users WHERE username = ?'
+_SQL_INSERT_USER = 'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)'
+_SQL_UPDATE_PASSWORD_HASH = 'UPDATE users SET password_hash = ? WHERE id = ?'
+# Everything the museum profile page needs from the DB: one row per review (or a single
+# row with NULL review columns), each carrying the viewer's wishlist status. The reviews
+# are selected on their own, so an unknown viewer can't hide them, and LIMIT only counts
+# reviews whose author still exists.
+_SQL_PROFILE_BUNDLE = '''
+    SELECT v.is_visited, r.rating, r.review_text, r.timestamp, r.username
+    FROM (SELECT (SELECT is_visited FROM wishlist_status WHERE user_id = ? AND museum_key = ?) AS is_visited) v
+    LEFT JOIN (
+        SELECT r.rating, r.review_text, r.timestamp, u.username
+        FROM reviews r
+        JOIN users u ON u.id = r.user_id
+        WHERE r.museum_key = ?
+        ORDER BY r.timestamp DESC
+        LIMIT ?
+    ) r
+    ORDER BY r.timestamp DESC
+'''
+_SQL_INSERT_REVIEW = 'INSERT INTO reviews (user_id, museum_key, rating, review_text) VALUES (?, ?, ?, ?)'
+_SQL_REVIEWS_VERSION = 'SELECT MAX(id) FROM reviews'
+_SQL_AVG_RATINGS = 'SELECT museum_key, AVG(rating) AS avg_rating, COUNT(*) AS review_count FROM reviews GROUP BY museum_key'
+_SQL_GET_WISHLIST_MAP = 'SELECT museum_key, is_visited FROM wishlist_status WHERE user_id = ?'
+# A missing row counts as "not visited", so the first toggle inserts is_visited = 1
+_SQL_TOGGLE_WISHLIST = '''
+    INSERT INTO wishlist_status (user_id, museum_key, is_visited) VALUES (?, ?, 1)
+    ON CONFLICT (user_id, museum_key) DO UPDATE SET is_visited = 1 - is_visited
+    RETURNING is_visited
+'''
+_SQL_GET_SUMMARY = 'SELECT summary FROM ai_summaries WHERE museum_key = ? AND prompt_hash = ?'
+_SQL_SAVE_SUMMARY = 'INSERT OR REPLACE INTO ai_summaries (museum_key, prompt_hash, summary) VALUES (?, ?, ?)'
+# A random fresh quiz from the museum's pool, along with the number of fresh quizzes in it
+_SQL_GET_QUIZ = '''
+    SELECT id, quiz_json, COUNT(*) OVER () AS pool_size FROM quiz_variants
+    WHERE museum_key = ? AND created_at > datetime('now', ?)
+    ORDER BY RANDOM() LIMIT 1
+'''
+_SQL_GET_QUIZ_BY_ID = 'SELECT quiz_json FROM quiz_variants WHERE id = ? AND museum_key = ?'
+_SQL_SAVE_QUIZ = 'INSERT INTO quiz_variants (museum_key, quiz_json) VALUES (?, ?)'
+# Drops the museum's expired quizzes and everything beyond the newest QUIZ_POOL_SIZE
+_SQL_PRUNE_QUIZZES = '''
+    DELETE FROM quiz_variants WHERE museum_key = ? AND (
+        created_at <= datetime('now', ?)
+        OR id NOT IN (SELECT id FROM quiz_variants WHERE museum_key = ? ORDER BY id DESC LIMIT ?)
+    )
+'''
+# Claims the museum's quiz generation unless another worker holds a live claim. Failed and
+# abandoned (older than QUIZ_JOB_TIMEOUT) jobs may be claimed again. Returns a row only if claimed.
+_SQL_CLAIM_QUIZ_JOB = '''
+    INSERT INTO quiz_jobs (museum_key, state) VALUES (?, 'running')
+    ON CONFLICT (museum_key) DO UPDATE SET state = 'running', updated_at = CURRENT_TIMESTAMP
+    WHERE quiz_jobs.state = 'failed' OR quiz_jobs.updated_at <= datetime('now', ?)
+    RETURNING museum_key
+'''
+_SQL_GET_QUIZ_JOB_STATE = "SELECT state FROM quiz_jobs WHERE museum_key = ? AND updated_at > datetime('now', ?)"
+_SQL_FAIL_QUIZ_JOB = "UPDATE quiz_jobs SET state = 'failed', updated_at = CURRENT_TIMESTAMP WHERE museum_key = ?"
+_SQL_FINISH_QUIZ_JOB = 'DELETE FROM quiz_jobs WHERE museum_key = ? AND state = ?'
 
 # --- Utility Functions (Unmodified) ---
+# Write helpers don't commit. Callers group a request's writes in one `with get_db():`
+# transaction, so each request pays for a single commit (rolled back if anything raises).
 def get_user(username):
-    conn = get_db()
-    try:
-        cur = conn.execute('SELECT * FROM users WHERE username = ?', (username,))
-        row = cur.fetchone()
-        return row
-    finally:
-        conn.close()
+    """Full credentials row, only needed by the login path."""
+    return get_db().execute(_SQL_GET_USER, (username,)).fetchone()
 
 def create_user(username, email, password_hash):
-    conn = get_db()
-    try:
-        conn.execute(
-            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
-            (username, email, password_hash)
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    get_db().execute(_SQL_INSERT_USER, (username, email, password_hash))
 
-def user_exists(username):
-    return get_user(username) is not None
+def update_password_hash(user_id, password_hash):
+    get_db().execute(_SQL_UPDATE_PASSWORD_HASH, (password_hash, user_id))
 
 def get_user_id(username):
-    user = get_user(username)
-    return user['id'] if user else None
+    row = get_db().execute(_SQL_GET_USER_ID, (username,)).fetchone()
+    return row['id'] if row else None
 
-def get_museum_reviews(museum_key):
-    conn = get_db()
-    try:
-        cur = conn.execute('''
-            SELECT 
-                r.rating, r.review_text, r.timestamp, u.username 
-            FROM reviews r
-            JOIN users u ON r.user_id = u.id
-            WHERE r.museum_key = ?
-            ORDER BY r.timestamp DESC
-        ''', (museum_key,))
-        return cur.fetchall()
-    finally:
-        conn.close()
+# Reviews shown on a museum profile, newest first
+PROFILE_REVIEWS_LIMIT = 50
+
+def load_profile_bundle(user_id, museum_key):
+    """
+    Returns (is_visited, reviews) for the museum profile page from a single query.
+    reviews is the newest PROFILE_REVIEWS_LIMIT; an unknown user_id just counts as not visited.
+    """
+    rows = get_db().execute(
+        _SQL_PROFILE_BUNDLE, (user_id, museum_key, museum_key, PROFILE_REVIEWS_LIMIT)
+    ).fetchall()
+    reviews = [
+        {'rating': row['rating'], 'review_text': row['review_text'],
+         'timestamp': row['timestamp'], 'username': row['username']}
+        for row in rows if row['username'] is not None
+    ]
+    return rows[0]['is_visited'] or 0, reviews
 
 def add_museum_review(user_id, museum_key, rating, review_text):
-    conn = get_db()
-    try:
-        conn.execute(
-            'INSERT INTO reviews (user_id, museum_key, rating, review_text) VALUES (?, ?, ?, ?)',
-            (user_id, museum_key, rating, review_text)
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    get_db().execute(_SQL_INSERT_REVIEW, (user_id, museum_key, rating, review_text))
+
+def toggle_wishlist_status(user_id, museum_key):
+    return get_db().execute(_SQL_TOGGLE_WISHLIST, (user_id, museum_key)).fetchone()['is_visited']
 
-def get_wishlist_status(user_id, museum_key):
+def get_user_wishlist_map(user_id):
+    """{museum_key: is_visited} for every museum the user has toggled, in one query."""
+    cur = get_db().execute(_SQL_GET_WISHLIST_MAP, (user_id,))
+    return {row['museum_key']: row['is_visited'] for row in cur}
+
+# In-process memo for get_avg_ratings: (reviews version, averages). Reviews are only ever
+# inserted, so MAX(id) changes with every new review, whichever worker committed it.
+_ratings_cache = {'entry': (None, {})}
+
+def get_avg_ratings():
+    """
+    {museum_key: (average_rating, review_count)} for every reviewed museum. Recomputed with
+    one grouped query only when a review has been added since the last call; otherwise the
+    cost is a MAX(id) lookup on the reviews primary key.
+    """
     conn = get_db()
-    try:
-        cur = conn.execute(
-            'SELECT is_visited FROM wishlist_status WHERE user_id = ? AND museum_key = ?',
-            (user_id, museum_key)
-        )
-        row = cur.fetchone()
-        return row['is_visited'] if row else 0
-    finally:
-        conn.close()
+    version = conn.execute(_SQL_REVIEWS_VERSION).fetchone()[0]
+    cached_version, data = _ratings_cache['entry']
+    if version is not None and version == cached_version:
+        return data
+    data = {row['museum_key']: (row['avg_rating'], row['review_count']) for row in conn.execute(_SQL_AVG_RATINGS)}
+    # Version and data are replaced together, so concurrent readers never see a mismatched pair
+    _ratings_cache['entry'] = (version, data)
+    return data
 
-def toggle_wishlist_status(user_id, museum_key):
+def get_cached_summary(museum_key, prompt_hash):
+    row = get_db().execute(_SQL_GET_SUMMARY, (museum_key, prompt_hash)).fetchone()
+    return row['summary'] if row else None
+
+def save_summary(museum_key, prompt_hash, summary):
+    get_db().execute(_SQL_SAVE_SUMMARY, (museum_key, prompt_hash, summary))
+
+def get_cached_quiz(museum_key, max_age_seconds):
+    """Returns (quiz_data, pool_size): a random fresh quiz for the museum (or None) and the fresh pool size."""
+    row = get_db().execute(_SQL_GET_QUIZ, (museum_key, f'-{max_age_seconds} seconds')).fetchone()
+    if row is None:
+        return None, 0
+    quiz_data = orjson.loads(row['quiz_json'])
+    quiz_data['id'] = row['id']
+    return quiz_data, row['pool_size']
+
+def get_quiz_by_id(quiz_id, museum_key):
+    """The quiz a user was served, for scoring; None if it has since been pruned."""
+    row = get_db().execute(_SQL_GET_QUIZ_BY_ID, (quiz_id, museum_key)).fetchone()
+    return orjson.loads(row['quiz_json']) if row else None
+
+def save_quiz(museum_key, quiz_data):
+    """Adds a quiz to the museum's pool, pruning expired and surplus ones. Returns the new row id."""
     conn = get_db()
-    try:
-        current_status = get_wishlist_status(user_id, museum_key)
-        new_status = 1 if current_status == 0 else 0
-        
-        conn.execute(
-            'INSERT OR REPLACE INTO wishlist_status (user_id, museum_key, is_visited) VALUES (?, ?, ?)',
-            (user_id, museum_key, new_status)
-        )
-        conn.commit()
-        return new_status
-    finally:
-        conn.close()
+    quiz_id = conn.execute(_SQL_SAVE_QUIZ, (museum_key, orjson.dumps(quiz_data).decode('utf-8'))).lastrowid
+    conn.execute(_SQL_PRUNE_QUIZZES, (museum_key, f'-{QUIZ_CACHE_TTL} seconds', museum_key, QUIZ_POOL_SIZE))
+    return quiz_id
+
+def claim_quiz_job(museum_key):
+    """True if this worker now owns the museum's quiz generation."""
+    row = get_db().execute(_SQL_CLAIM_QUIZ_JOB, (museum_key, f'-{QUIZ_JOB_TIMEOUT} seconds')).fetchone()
+    return row is not None
+
+def get_quiz_job_state(museum_key):
+    row = get_db().execute(_SQL_GET_QUIZ_JOB_STATE, (museum_key, f'-{QUIZ_JOB_TIMEOUT} seconds')).fetchone()
+    return row['state'] if row else None
+
+def fail_quiz_job(museum_key):
+    get_db().execute(_SQL_FAIL_QUIZ_JOB, (museum_key,))
+
+def finish_quiz_job(museum_key, state):
+    """Removes the museum's job row if it is still in `state`, so a newer claim isn't dropped."""
+    get_db().execute(_SQL_FINISH_QUIZ_JOB, (museum_key, state))
+
+def current_user_id():
+    """
+    The logged-in user's id, stored in the session at login so pages skip the username lookup.
+    Sessions from before user_id was stored are resolved from the username once and upgraded.
+    """
+    user_id = session.get('user_id')
+    if user_id is None:
+        user_id = get_user_id(session['user'])
+        session['user_id'] = user_id
+    return user_id
+
+# Signup form checks as (message, predicate over username, email, password, confirm_password),
+# in the order they are reported. Duplicate usernames are left to the UNIQUE constraint.
+SIGNUP_CHECKS = (
+    ('Please complete all fields', lambda username, email, password, confirm: username and email and password),
+    ('Passwords do not match', lambda username, email, password, confirm: password == confirm),
+    ('Password must be at least 6 characters', lambda username, email, password, confirm: len(password) >= 6),
+)
+
+def signup_error(username, email, password, confirm_password):
+    """The message of the first failing signup check, or None if the form is valid."""
+    for message, check in SIGNUP_CHECKS:
+        if not check(username, email, password, confirm_password):
+            return message
+    return None
 
 # --- Authentication Decorator (Unmodified) ---
 def login_required(f):
@@ -550,8 +1014,14 @@ def login():
             return render_template('login.html')
 
         user = get_user(username)
-        if user and check_password_hash(user['password_hash'], password):
+        password_ok = check_password_hash(user['password_hash'] if user else dummy_password_hash(), password)
+        if user and password_ok:
+            # Rehash passwords stored with a method other than the configured one
+            if user['password_hash'].split('$', 1)[0] != password_hash_prefix():
+                with get_db():
+                    update_password_hash(user['id'], generate_password_hash(password, method=PASSWORD_HASH_METHOD))
             session['user'] = user['username']
+            session['user_id'] = user['id']
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -562,23 +1032,22 @@ def login():
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
     if request.method == 'POST':
-        username = (request.form.get('username') or '').strip()
-        email = (request.form.get('email') or '').strip()
-        password = request.form.get('password') or ''
-        confirm_password = request.form.get('confirm_password') or ''
-
-        if not username or not email or not password:
-            flash('Please complete all fields', 'error')
-        elif user_exists(username):
-            flash('Username already exists', 'error')
-        elif password != confirm_password:
-            flash('Passwords do not match', 'error')
-        elif len(password) < 6:
-            flash('Password must be at least 6 characters', 'error')
+        form_get = request.form.get
+        username = (form_get('username') or '').strip()
+        email = (form_get('email') or '').strip()
+        password = form_get('password') or ''
+        confirm_password = form_get('confirm_password') or ''
+
+        error = signup_error(username, email, password, confirm_password)
+        if error:
+            flash(error, 'error')
         else:
-            password_hash = generate_password_hash(password)
+            password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+            # The UNIQUE constraint on users.username is the duplicate check, so the
+            # common (new username) case costs a single INSERT
             try:
-                create_user(username, email, password_hash)
+                with get_db():
+                    create_user(username, email, password_hash)
                 flash('Account created successfully! Please login.', 'success')
                 return redirect(url_for('login'))
             except sqlite3.IntegrityError:
@@ -589,6 +1058,7 @@ def signup():
 @app.route('/logout')
 def logout():
     session.pop('user', None)
+    session.pop('user_id', None)
     flash('You have been logged out', 'success')
     return redirect(url_for('login'))
 
@@ -599,29 +1069,21 @@ def logout():
 @login_required
 def dashboard():
     search_query = request.args.get('search', '').lower()
-    
-    museum_list = []
-    for key, data in MUSEUM_DATA.items():
-        data_with_key = data.copy()
-        data_with_key['key'] = key
-        museum_list.append(data_with_key)
-        
+
     if search_query:
-        filtered_museums = [
-            m for m in museum_list 
-            if search_query in m['name'].lower() or search_query in m['city'].lower()
-        ]
-        museums_to_display = filtered_museums
+        museums_to_display = search_museums(search_query)
     else:
-        museums_to_display = museum_list 
-
-    museums_to_display.sort(key=lambda m: m['name'])
+        museums_to_display = MUSEUMS_BY_NAME
 
+    # Badges for every card come from two grouped queries rather than one lookup per museum.
+    # They are per user, so the directory grid is rendered per request (no museum_grid_html).
     return render_template(
         'dashboard.html', 
         museums=museums_to_display, 
         search_query=search_query,
-        is_quiz_selection=False # Ensure quiz link behavior is off for regular dashboard
+        is_quiz_selection=False, # Ensure quiz link behavior is off for regular dashboard
+        wishlist_map=get_user_wishlist_map(current_user_id()),
+        avg_ratings=get_avg_ratings()
     )
 
 # --- NEW QUIZ SELECTION ROUTE ---
@@ -629,20 +1091,13 @@ def dashboard():
 @login_required
 def quiz_selection():
     """Renders the quiz selection page using the dashboard template."""
-    museum_list = []
-    for key, data in MUSEUM_DATA.items():
-        data_with_key = data.copy()
-        data_with_key['key'] = key
-        museum_list.append(data_with_key)
-    
-    museum_list.sort(key=lambda m: m['name'])
-    
     return render_template(
         'dashboard.html', 
-        museums=museum_list, 
+        museums=MUSEUMS_BY_NAME, 
         search_query="",
         is_quiz_selection=True, # Flag to change link behavior in template
-        quiz_message="Select a museum to generate an AI Quiz!"
+        quiz_message="Select a museum to generate an AI Quiz!",
+        museum_grid_html=museum_grid_html(True)
     )
 # --- END NEW QUIZ SELECTION ROUTE ---
 
@@ -657,11 +1112,12 @@ def museum_profile(museum_name):
         flash('Museum profile not found.', 'error')
         return redirect(url_for('dashboard'))
 
-    user_id = get_user_id(session['user'])
-    
     if request.method == 'POST':
+        user_id = current_user_id()
+
         if 'toggle_visited' in request.form:
-            new_status = toggle_wishlist_status(user_id, museum_key)
+            with get_db():
+                new_status = toggle_wishlist_status(user_id, museum_key)
             status_message = 'Visited' if new_status == 1 else 'Wishlist'
             flash(f'Status for {museum_details["name"]} updated to {status_message}.', 'success')
         
@@ -673,7 +1129,8 @@ def museum_profile(museum_name):
                 rating = 0
 
             if review_text and 1 <= rating <= 5:
-                add_museum_review(user_id, museum_key, rating, review_text)
+                with get_db():
+                    add_museum_review(user_id, museum_key, rating, review_text)
                 flash('Your review has been posted!', 'success')
             else:
                 flash('Invalid review or rating submitted.', 'error')
@@ -682,25 +1139,40 @@ def museum_profile(museum_name):
 
     # GET request processing
     
-    # 1. Fetch the AI Summary using Gemini API
-    ai_summary = get_museum_summary(museum_details['name'], museum_details['city'])
+    # 1. Use the AI Summary if it's cached. Otherwise the page renders right away with a
+    # placeholder and fetches it from museum_summary, so Gemini never holds up the page.
+    ai_summary = cached_museum_summary(museum_key, museum_details['name'], museum_details['city'])
+    if ai_summary is None and (AI_CACHE_REPLAY or GEMINI_CLIENT is None):
+        # No API call will be made, so the fallback message is instant
+        ai_summary = get_museum_summary(museum_key, museum_details['name'], museum_details['city'])
 
-    # 2. Fetch current wishlist status
-    is_visited = get_wishlist_status(user_id, museum_key)
-    
-    # 3. Fetch all reviews
-    reviews = get_museum_reviews(museum_key)
+    # 2. Fetch current wishlist status and all reviews in one query
+    is_visited, reviews = load_profile_bundle(current_user_id(), museum_key)
+
+    response = make_response(render_template('museum_profile.html', 
+                                             details=museum_details, 
+                                             reviews=reviews, 
+                                             wishlist_status=is_visited, 
+                                             museum_key=museum_key,
+                                             ai_summary=ai_summary, 
+                                             gallery_images=_GALLERY_IMAGES[museum_key]))
+
+    # 3. Conditional GET: the page carries the user's wishlist status and the latest reviews,
+    # so only the browser may store it and must revalidate. An unchanged page is answered
+    # with a bodyless 304 instead of resending the full HTML.
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
-    # 4. Extract image URLs for the gallery from the top_exhibits data
-    gallery_images = [exhibit['img'] for exhibit in museum_details.get('top_exhibits', [])]
 
-    return render_template('museum_profile.html', 
-                           details=museum_details, 
-                           reviews=reviews, 
-                           wishlist_status=is_visited, 
-                           museum_key=museum_key,
-                           ai_summary=ai_summary, 
-                           gallery_images=gallery_images)
+@app.route('/museum/<museum_name>/summary', methods=['GET'])
+@login_required
+def museum_summary(museum_name):
+    """Fetched by a profile page rendered without its summary; may wait on the Gemini API."""
+    museum_details = MUSEUM_DATA.get(museum_name)
+    if not museum_details:
+        return jsonify({'error': 'Museum not found.'}), 404
+    return jsonify({'summary': get_museum_summary(museum_name, museum_details['name'], museum_details['city'])})
 
 
 # --- NEW QUIZ ROUTE ---
@@ -716,34 +1188,42 @@ def quiz(museum_key):
     
     if request.method == 'POST':
         # --- QUIZ SUBMISSION AND SCORING ---
-        if 'current_quiz' not in session or session['current_quiz']['museum_key'] != museum_key:
+        # The session only holds a handle to the quiz (sessions from before that held the
+        # whole quiz and no 'id', and are treated as expired)
+        current_quiz = session.get('current_quiz')
+        if not current_quiz or 'id' not in current_quiz or current_quiz['museum_key'] != museum_key:
             flash('Quiz session expired or mismatched. Please generate a new quiz.', 'error')
             return redirect(url_for('quiz_selection'))
-            
-        submitted_answers = request.form
-        quiz_data = session.get('current_quiz')
-        
-        score = 0
-        total_questions = len(quiz_data['questions'])
-        results = []
-
-        for i, q in enumerate(quiz_data['questions']):
-            user_answer_key = f'q_{i}'
-            user_answer = submitted_answers.get(user_answer_key)
-            
-            # Check if the submitted answer text matches the correct answer text
-            is_correct = (user_answer == q['answer'])
-            
-            if is_correct:
-                score += 1
-            
-            results.append({
+
+        if current_quiz['id'] is None:
+            # The fallback quiz is never stored, but it is deterministic
+            quiz_data = fallback_quiz(museum_name, museum_details['city'])
+        else:
+            quiz_data = get_quiz_by_id(current_quiz['id'], museum_key)
+        if quiz_data is None:
+            session.pop('current_quiz', None)
+            flash('Quiz session expired or mismatched. Please generate a new quiz.', 'error')
+            return redirect(url_for('quiz_selection'))
+
+        questions = quiz_data['questions']
+        get_answer = request.form.get
+        total_questions = len(questions)
+
+        # An answer is correct when the submitted text matches the correct answer text
+        submitted = [get_answer(f'q_{i}') for i in range(total_questions)]
+        flags = [user_answer == q['answer'] for user_answer, q in zip(submitted, questions)]
+        score = sum(flags)
+
+        results = [
+            {
                 'question': q['question'],
                 'user_answer': user_answer,
                 'correct_answer': q['answer'],
                 'is_correct': is_correct,
                 'options': q['options']
-            })
+            }
+            for q, user_answer, is_correct in zip(questions, submitted, flags)
+        ]
 
         # Clear the quiz data from session after scoring
         session.pop('current_quiz', None)
@@ -759,18 +1239,43 @@ def quiz(museum_key):
 
     else:
         # --- QUIZ GENERATION (GET) ---
-        flash(f"Generating a new AI Quiz for {museum_name}...", 'info')
         
-        # 1. Generate the quiz
-        quiz_data = generate_quiz(museum_name, museum_details['city'])
+        # 1. Serve a quiz from the pool, or start generating one in the background
+        quiz_data, pool_size = get_cached_quiz(museum_key, QUIZ_CACHE_TTL)
+        if quiz_data is not None:
+            if pool_size < QUIZ_POOL_SIZE and not AI_CACHE_REPLAY and GEMINI_CLIENT is not None:
+                # Top the pool up off the request path; this visitor gets the cached quiz
+                start_quiz_generation(museum_key, museum_name, museum_details['city'])
+        else:
+            if AI_CACHE_REPLAY or GEMINI_CLIENT is None:
+                # No API call will be made, so generating inline is instant
+                quiz_data = generate_quiz(museum_key, museum_name, museum_details['city'])
+            else:
+                state = quiz_generation_state(museum_key)
+                if state == 'failed':
+                    # Generation failed (on whichever worker ran it): serve the fallback quiz
+                    # once, and let the next visit try Gemini again
+                    with get_db():
+                        finish_quiz_job(museum_key, 'failed')
+                    quiz_data = fallback_quiz(museum_name, museum_details['city'])
+                else:
+                    if state is None:
+                        start_quiz_generation(museum_key, museum_name, museum_details['city'])
+                    flash(f"Generating a new AI Quiz for {museum_name}...", 'info')
+                    return render_template('quiz.html', 
+                                           museum_name=museum_name, 
+                                           quiz_title=f"{museum_name} Quiz", 
+                                           museum_key=museum_key,
+                                           quiz_pending=True,
+                                           quiz_submitted=False)
         
         if not quiz_data or not quiz_data.get('questions'):
             flash('Could not generate quiz. Please try again.', 'error')
             return redirect(url_for('quiz_selection'))
         
-        # 2. Store the quiz data (including answers) in the session
-        quiz_data['museum_key'] = museum_key # Store key for verification
-        session['current_quiz'] = quiz_data
+        # 2. Store a handle to the quiz in the session; the answers stay server-side.
+        # The row is not deleted after scoring because the pool is shared by all users.
+        session['current_quiz'] = {'id': quiz_data.get('id'), 'museum_key': museum_key}
         
         # 3. Render the quiz form
         return render_template('quiz.html', 
@@ -780,5 +1285,107 @@ def quiz(museum_key):
                                museum_key=museum_key,
                                quiz_submitted=False)
 
+@app.route('/api/quiz_status/<museum_key>', methods=['GET'])
+@login_required
+def quiz_status(museum_key):
+    """Polled by the 'preparing quiz' page: 202 while generating, 200 once /quiz can be served."""
+    if museum_key not in MUSEUM_DATA:
+        return jsonify({'error': 'Museum not found.'}), 404
+    if quiz_generation_state(museum_key) == 'running':
+        return jsonify({'ready': False}), 202
+    return jsonify({'ready': True})
+
+
+# --- CLI COMMANDS ---
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema. Run once per deploy, before starting workers."""
+    init_db()
+    click.echo(f"Database {db_path} is at schema version {SCHEMA_VERSION}.")
+
+
+@app.cli.command('time-password-hash')
+@click.option('--method', default=None, help='Hash method to time (default: PASSWORD_HASH_METHOD).')
+@click.option('--rounds', default=10, show_default=True, help='Number of hashes to average over.')
+def time_password_hash(method, rounds):
+    """Time password hashing on this machine, to pick a cost of ~100 ms per hash."""
+    method = method or PASSWORD_HASH_METHOD
+    started = time.perf_counter()
+    for _ in range(rounds):
+        generate_password_hash('benchmark-password', method=method)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / rounds
+    click.echo(f"{method}: {elapsed_ms:.1f} ms per hash")
+
+
+@app.cli.command('seed-ai-cache')
+@click.option('--force', is_flag=True, help='Regenerate entries that are already cached.')
+@click.option('--poll-interval', default=30, show_default=True, help='Seconds between batch job status checks.')
+def seed_ai_cache(force, poll_interval):
+    """Pre-generate summaries and quizzes for every museum with the Gemini Batch API."""
+    if GEMINI_CLIENT is None:
+        raise click.ClickException("Gemini client unavailable. Check your GEMINI_API_KEY.")
+    init_db()
+
+    # (kind, museum_key, request) in submission order; batch responses come back in the same order
+    pending = []
+    for key, data in MUSEUM_DATA.items():
+        prompt_hash = summary_cache_key(data['name'], data['city'])
+        if force or get_cached_summary(key, prompt_hash) is None:
+            pending.append(('summary', key, types.InlinedRequest(
+                contents=summary_prompt(data['name'], data['city'])
+            )))
+        # Fill the museum's quiz pool; --force replaces all of it
+        _, pool_size = get_cached_quiz(key, QUIZ_CACHE_TTL)
+        missing_quizzes = QUIZ_POOL_SIZE if force else QUIZ_POOL_SIZE - pool_size
+        for _ in range(missing_quizzes):
+            pending.append(('quiz', key, types.InlinedRequest(
+                contents=quiz_prompt(data['name'], data['city']),
+                config=QUIZ_CONFIG
+            )))
+
+    if not pending:
+        click.echo("AI cache is already warm, nothing to do.")
+        return
+
+    job = GEMINI_CLIENT.batches.create(
+        model=GEMINI_MODEL,
+        src=[req for _, _, req in pending],
+        config=types.CreateBatchJobConfig(display_name='digi-museum-seed-ai-cache')
+    )
+    click.echo(f"Submitted batch job {job.name} with {len(pending)} requests.")
+
+    finished_states = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+    while job.state.name not in finished_states:
+        time.sleep(poll_interval)
+        job = GEMINI_CLIENT.batches.get(name=job.name)
+        click.echo(f"Batch job state: {job.state.name}")
+
+    if job.state.name != 'JOB_STATE_SUCCEEDED':
+        raise click.ClickException(f"Batch job ended in state {job.state.name}: {job.error}")
+
+    # All results are stored in one transaction, so the whole batch costs a single commit
+    stored = 0
+    with get_db():
+        for (kind, key, _), result in zip(pending, job.dest.inlined_responses):
+            data = MUSEUM_DATA[key]
+            if result.error or not result.response or not result.response.text:
+                click.echo(f"Skipping {kind} for {key}: {result.error}")
+                continue
+            if kind == 'summary':
+                save_summary(key, summary_cache_key(data['name'], data['city']), result.response.text)
+            else:
+                try:
+                    save_quiz(key, parse_quiz(result.response.text))
+                except ValueError as e:
+                    click.echo(f"Skipping quiz for {key}: {e}")
+                    continue
+            stored += 1
+
+    click.echo(f"Stored {stored} of {len(pending)} AI cache entries.")
+
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # The dev server has no separate deploy step, so bring the schema up to date here
+    with app.app_context():
+        init_db()
+    app.run(debug=os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes'), port=5000)
\ No newline at end of file
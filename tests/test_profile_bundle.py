@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+import app as museum_app
+
+
+class LoadProfileBundleTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.orig_db_path = museum_app.db_path
+        museum_app.db_path = os.path.join(self.tmpdir.name, 'test.db')
+        self.ctx = museum_app.app.app_context()
+        self.ctx.push()
+        museum_app.init_db()
+
+        conn = museum_app.get_db()
+        with conn:
+            museum_app.create_user('alice', 'a@example.com', 'x')
+            museum_app.create_user('bob', 'b@example.com', 'x')
+            self.alice_id = museum_app.get_user_id('alice')
+            self.bob_id = museum_app.get_user_id('bob')
+            museum_app.add_museum_review(self.alice_id, 'bihar_museum_patna', 4, 'great')
+            museum_app.toggle_wishlist_status(self.alice_id, 'bihar_museum_patna')
+
+    def tearDown(self):
+        self.ctx.pop()
+        museum_app.db_path = self.orig_db_path
+        self.tmpdir.cleanup()
+
+    def test_unknown_user_still_sees_reviews(self):
+        is_visited, reviews = museum_app.load_profile_bundle(999999, 'bihar_museum_patna')
+        self.assertEqual(is_visited, 0)
+        self.assertEqual([(r['username'], r['rating']) for r in reviews], [('alice', 4)])
+
+    def test_viewer_status_and_reviews(self):
+        is_visited, reviews = museum_app.load_profile_bundle(self.alice_id, 'bihar_museum_patna')
+        self.assertEqual(is_visited, 1)
+        self.assertEqual(len(reviews), 1)
+
+    def test_museum_without_reviews(self):
+        self.assertEqual(museum_app.load_profile_bundle(self.bob_id, 'bihar_museum_patna')[0], 0)
+        self.assertEqual(museum_app.load_profile_bundle(self.alice_id, 'csmvs_mumbai'), (0, []))
+
+    def test_limit_skips_reviews_of_deleted_users(self):
+        conn = museum_app.get_db()
+        with conn:
+            for _ in range(museum_app.PROFILE_REVIEWS_LIMIT):
+                museum_app.add_museum_review(self.bob_id, 'csmvs_mumbai', 3, 'ok')
+            conn.execute('UPDATE reviews SET timestamp = ?', ('2020-01-01 00:00:00',))
+            # Newer reviews by a user that no longer exists
+            for _ in range(5):
+                museum_app.add_museum_review(424242, 'csmvs_mumbai', 1, 'gone')
+        _, reviews = museum_app.load_profile_bundle(self.bob_id, 'csmvs_mumbai')
+        self.assertEqual(len(reviews), museum_app.PROFILE_REVIEWS_LIMIT)
+        self.assertTrue(all(r['username'] == 'bob' for r in reviews))
+
+
+if __name__ == '__main__':
+    unittest.main()